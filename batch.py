@@ -0,0 +1,144 @@
+"""
+Applies a saved preset to lots of images at once without opening the editor
+
+Images keep the folders they were in under the part of their pattern before
+the first wildcard, so "scans/**/*.png" saves scans/a/x.png as out/a/x.png.
+Nothing is saved if two images would end up with the same output name.
+
+Example:
+    python batch.py "scans/*.png" "more/**/*.jpg" --preset "Pop Art" --output out --format png --workers 8
+"""
+import argparse
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import cv2
+from core import posterize
+from presets import find_preset
+
+# The folder a pattern's matches are saved relative to, everything before the first wildcard
+def glob_root(pattern):
+    if not glob.has_magic(pattern):
+        return os.path.dirname(pattern)
+
+    root = []
+    for part in pattern.replace("\\", "/").split("/"):
+        if glob.has_magic(part):
+            break
+        root.append(part)
+
+    return "/".join(root)
+
+# Turns the paths and patterns from the command line into a list of (file, root) pairs
+def find_images(patterns):
+    files = []
+    seen = set()
+
+    for pattern in patterns:
+        root = glob_root(pattern)
+        matches = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        for file in matches:
+            if os.path.isfile(file) and file not in seen:
+                seen.add(file)
+                files.append((file, root))
+
+    return files
+
+# Where each image gets saved, keeping its folders under its pattern's root so images with the same name don't
+# overwrite each other, images that would still end up at the same place are given back as collisions
+def plan_outputs(files, output_dir, extension):
+    outputs = {} # File to where it's saved
+    sources = {} # Where it's saved to every file that would be saved there
+
+    for file, root in files:
+        name = os.path.splitext(os.path.relpath(file, root or "."))[0]
+        output = os.path.normpath(os.path.join(output_dir, f"{name}.{extension}"))
+
+        outputs[file] = output
+        sources.setdefault(output, []).append(file)
+
+    collisions = {output: files for output, files in sources.items() if len(files) > 1}
+    return outputs, collisions
+
+# Opens, posterizes and saves one image, this runs in a worker process
+def process_image(file, output, breaks, colors):
+    image = cv2.imread(file, 0)
+    if image is None:
+        raise ValueError(f"Unable to open image: {file}")
+
+    # Colors are flipped to bgr so the result is already in the order opencv saves in
+    image_cstm = posterize(image, breaks, [color[::-1] for color in colors])
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    if not cv2.imwrite(output, image_cstm):
+        raise ValueError(f"Unable to save image: {output}")
+
+    return output
+
+# Runs every image through the worker processes, only keeping a few waiting at a time, outputs maps file to where it's saved
+def run(outputs, config, workers):
+    breaks = config["breaks"]
+    colors = config["colors"]
+    max_in_flight = workers * 2
+
+    failed = 0
+    files = iter(outputs)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+
+        while True:
+            # Keeping the pool full without queueing every image up front
+            for file in files:
+                future = executor.submit(process_image, file, outputs[file], breaks, colors)
+                in_flight[future] = file
+                if len(in_flight) >= max_in_flight:
+                    break
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file = in_flight.pop(future)
+                try:
+                    print(f"{file} -> {future.result()}")
+                except Exception as error:
+                    failed += 1
+                    print(f"{file} failed: {error}", file=sys.stderr)
+
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a saved preset to many images at once.")
+    parser.add_argument("inputs", nargs="+", help="image files or glob patterns, ** searches subfolders")
+    parser.add_argument("-p", "--preset", required=True, help="name of the preset to apply")
+    parser.add_argument("-o", "--output", required=True, help="folder to save the images to")
+    parser.add_argument("-f", "--format", default="png", choices=["png", "jpg", "jpeg", "tif", "tiff"], help="format to save the images as")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--presets", default="presets.json", help="presets file to read the preset from")
+    args = parser.parse_args(argv)
+
+    try:
+        config = find_preset(args.preset, args.presets)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    files = find_images(args.inputs)
+    if not files:
+        parser.error("no images matched the given inputs")
+
+    outputs, collisions = plan_outputs(files, args.output, args.format)
+    if collisions:
+        for output, sources in collisions.items():
+            print(f"{output} would be saved from more than one image: {', '.join(sources)}", file=sys.stderr)
+        parser.error("some images would overwrite each other, nothing was saved")
+
+    failed = run(outputs, config, max(args.workers, 1))
+
+    print(f"Finished {len(files) - failed} of {len(files)} images")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
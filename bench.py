@@ -0,0 +1,222 @@
+"""
+Benchmarks for the slow parts of the Andy Warhol Style Image Editor
+
+Times posterizing, repainting after a small break move, resizing, opening
+files, making the color wheel, drawing a preview frame and making mosaics on
+made up images from 1 to 100 megapixels and on cat.jpeg. Each case reports its best time, megapixels
+per second and peak memory. Results can be saved as a baseline and later runs
+compared against it, failing when a case gets slower than the allowed
+threshold. Nothing here needs a display.
+
+Examples:
+    python bench.py --save-baseline bench_baseline.json
+    python bench.py --baseline bench_baseline.json --threshold 0.25
+    python bench.py --sizes 1 4 --colors 2 8 --stages posterize compress
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import cv2
+from PIL import Image
+import core
+
+SCREEN_SIZE = (1920, 1080)
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cat.jpeg")
+
+# Makes a repeatable rgb test image with about this many megapixels and a 3:2 shape
+def synthetic_image(megapixels, seed=0):
+    height = int((megapixels * 1e6 / 1.5) ** 0.5)
+    width = int(height * 1.5)
+
+    # A small random tile repeated over a gradient so the image isn't all noise
+    rng = np.random.default_rng(seed)
+    tile = rng.integers(0, 64, (256, 256, 3), dtype=np.uint8)
+    image = np.tile(tile, (height // 256 + 1, width // 256 + 1, 1))[:height, :width]
+    gradient = (np.arange(width) * 191 // max(width - 1, 1)).astype(np.uint8)
+    image += gradient[None, :, None]
+
+    return image
+
+# Colors and breaks evenly spread out for n colors
+def spread_preset(n):
+    breaks = [int(255 * (i + 1) / n) - 1 for i in range(n - 1)]
+    colors = [(int(255 * i / (n - 1)), 0, int(255 * (n - 1 - i) / (n - 1))) for i in range(n)]
+    return breaks, colors
+
+# Runs a function a few times, gives back the best time and the peak memory of one more traced run
+def measure(function, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return best, peak
+
+# Every case as (name, megapixels, function), made lazily so only the chosen stages build their inputs
+def cases(sizes, color_counts, stages, folder):
+    for size in sizes:
+        image = None
+
+        for stage in stages:
+            if stage in ("wheel", "display"):
+                continue
+
+            if image is None:
+                image = synthetic_image(size)
+                gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+            megapixels = image.shape[0] * image.shape[1] / 1e6
+
+            if stage == "posterize":
+                for n in color_counts:
+                    breaks, colors = spread_preset(n)
+                    yield f"posterize/{size:g}MP/{n}colors", megapixels, lambda b=breaks, c=colors: core.posterize(gray, b, c)
+            elif stage == "repaint":
+                # Moving the one break back and forth by a step, the first two renders make the buffer and the sort
+                _, colors = spread_preset(2)
+                posterizer = core.Posterizer(gray)
+                steps = itertools.cycle([127, 128])
+                posterizer.render([127], colors)
+                posterizer.render([128], colors)
+                yield f"repaint/{size:g}MP/step", megapixels, lambda p=posterizer, c=colors: p.render([next(steps)], c)
+            elif stage == "compress":
+                yield f"compress/{size:g}MP/rgb", megapixels, lambda: core.compress_image(image, SCREEN_SIZE)
+                yield f"compress/{size:g}MP/gray", megapixels, lambda: core.compress_image(gray, SCREEN_SIZE)
+            elif stage == "open":
+                file = os.path.join(folder, f"synthetic_{size:g}.png")
+                cv2.imwrite(file, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+                yield f"open/{size:g}MP/png", megapixels, lambda f=file: core.load_images(f, SCREEN_SIZE)
+            elif stage == "mosaic":
+                yield f"mosaic/{size:g}MP/200x200", megapixels, lambda: core.mosaic(image, (200, 200))
+
+        image = gray = None
+
+    if "display" in stages:
+        # Drawing one preview frame, the old way made a new image, a resized copy and a new PhotoImage every
+        # frame and the editor now wraps the array and pastes it into the same PhotoImage. Without a display
+        # only the Pillow side can be timed
+        preview = core.compress_image(synthetic_image(4), SCREEN_SIZE)
+        size = (preview.shape[1], preview.shape[0])
+        megapixels = size[0] * size[1] / 1e6
+        root = tk_root()
+
+        if root is None:
+            yield "display/new_image", megapixels, lambda: Image.fromarray(preview).resize(size)
+            yield "display/paste", megapixels, lambda: Image.frombuffer("RGB", size, preview, "raw", "RGB", 0, 1)
+        else:
+            from PIL import ImageTk
+
+            photo = ImageTk.PhotoImage("RGB", size, master=root)
+            yield "display/new_image", megapixels, lambda: ImageTk.PhotoImage(Image.fromarray(preview).resize(size), master=root)
+            yield "display/paste", megapixels, lambda: photo.paste(Image.frombuffer("RGB", size, preview, "raw", "RGB", 0, 1))
+
+    if "wheel" in stages:
+        # Wheels are cached, the uncached function is timed so every run really builds one
+        yield "wheel/300px", 0.09, lambda: core.create_color_wheel.__wrapped__(300)
+
+    # The same stages on the real photo in the repo
+    if os.path.exists(FIXTURE):
+        image = cv2.cvtColor(cv2.imread(FIXTURE), cv2.COLOR_BGR2RGB)
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        megapixels = image.shape[0] * image.shape[1] / 1e6
+        breaks, colors = spread_preset(4)
+
+        if "open" in stages:
+            yield "open/cat.jpeg", megapixels, lambda: core.load_images(FIXTURE, SCREEN_SIZE)
+        if "posterize" in stages:
+            yield "posterize/cat.jpeg/4colors", megapixels, lambda: core.posterize(gray, breaks, colors)
+        if "compress" in stages:
+            yield "compress/cat.jpeg/rgb", megapixels, lambda: core.compress_image(image, (640, 480))
+        if "mosaic" in stages:
+            yield "mosaic/cat.jpeg/10x10", megapixels, lambda: core.mosaic(image, (10, 10))
+
+# A hidden Tk window for timing PhotoImages, None when there's no Tk or no display
+def tk_root():
+    try:
+        import tkinter
+    except ImportError as error:
+        print(f"No Tk, only timing the Pillow side of display: {error}", file=sys.stderr)
+        return None
+
+    try:
+        root = tkinter.Tk()
+    except tkinter.TclError as error:
+        print(f"No display for Tk, only timing the Pillow side of display: {error}", file=sys.stderr)
+        return None
+
+    root.withdraw()
+    return root
+
+def run(sizes, color_counts, stages, repeats):
+    results = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        for name, megapixels, function in cases(sizes, color_counts, stages, folder):
+            seconds, peak = measure(function, repeats)
+            results[name] = {
+                "seconds": seconds,
+                "mpix_per_s": megapixels / seconds if seconds > 0 else float("inf"),
+                "peak_mb": peak / 1e6
+            }
+            print(f"{name:<32} {seconds * 1000:10.2f} ms {results[name]['mpix_per_s']:10.1f} MP/s {results[name]['peak_mb']:10.1f} MB", flush=True)
+
+    return results
+
+# Finds every case that got slower than the baseline by more than the threshold
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result["seconds"] / baseline[name]["seconds"]
+            if ratio > 1 + threshold:
+                regressions.append((name, ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the image processing hot paths.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 24, 100], help="synthetic image sizes in megapixels")
+    parser.add_argument("--colors", type=int, nargs="+", default=[2, 4, 8, 16], help="color counts to posterize with")
+    parser.add_argument("--stages", nargs="+", default=["posterize", "repaint", "compress", "open", "wheel", "display", "mosaic"],
+                        choices=["posterize", "repaint", "compress", "open", "wheel", "display", "mosaic"], help="stages to benchmark")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per case, the best one is kept")
+    parser.add_argument("--baseline", help="baseline json to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before failing, 0.2 is 20%%")
+    parser.add_argument("--save-baseline", help="save the results to this json file")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.colors, args.stages, max(args.repeats, 1))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=4)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            print(f"REGRESSION {name}: {ratio:.2f}x the baseline time", file=sys.stderr)
+
+        if regressions:
+            return 1
+        print(f"No regressions over {args.threshold:.0%} against {args.baseline}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
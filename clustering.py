@@ -1,6 +1,4 @@
-import numpy as np
 # from sklearn.cluster import SpectralClustering
-import cv2
 # import matplotlib.pyplot as plt
 # from mpl_toolkits.mplot3d import Axes3D
 # from matplotlib.animation import FuncAnimation
@@ -8,30 +6,170 @@ import cv2
 # from sklearn.neighbors import KNeighborsClassifier
 
 # from sklearn.metrics import pairwise_distances_argmin
+from core import grid
 
+# Makes breaks whole numbers that go up one after another and fit on the slider
+def fit_breaks(values):
+    breaks = []
+    for i, value in enumerate(values):
+        low = breaks[-1] + 1 if breaks else 0
+        high = 254 - (len(values) - 1 - i)
+        breaks.append(min(max(int(value), low), high))
 
-def grid(image, grid_size=(10, 10)):
-    h, w, _ = image.shape
-    cell_h = h // grid_size[0]
-    cell_w = w // grid_size[1]
+    return breaks
 
-    mosaic = np.zeros_like(image)
+# Breaks that give every color about the same number of pixels
+def quantile_breaks(histogram, n):
+    import numpy as np
 
-    for row in range(grid_size[0]):
-        for col in range(grid_size[1]):
-            y1, y2 = row * cell_h, (row + 1) * cell_h
-            x1, x2 = col * cell_w, (col + 1) * cell_w
+    cdf = np.cumsum(histogram)
+    targets = cdf[-1] * np.arange(1, n) / n
 
-            cell = image[y1:y2, x1:x2]
-            mean_color = cell.mean(axis=(0, 1)).astype(int)
+    return fit_breaks(np.searchsorted(cdf, targets))
 
-            print(mean_color)
+# Breaks that best separate the gray values into n groups (multi-level Otsu)
+def otsu_breaks(histogram, n):
+    import numpy as np
 
-            # Fill the mosaic cell with the mean color
-            mosaic[y1:y2, x1:x2] = mean_color
+    levels = np.arange(256)
+    weights = np.concatenate([[0], np.cumsum(histogram, dtype=np.float64)])
+    sums = np.concatenate([[0], np.cumsum(histogram * levels, dtype=np.float64)])
 
-    cv2.imwrite('new_mosaic.jpg', mosaic)
-    return mosaic
+    # How well gray values start to end (exclusive) fit together as one group, for every start and end at once
+    start = levels[:, None]
+    end = levels[None, :] + 1
+    weight = weights[end] - weights[start]
+    total = sums[end] - sums[start]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        score = np.where((end > start) & (weight > 0), total * total / weight, 0)
+    score[end <= start] = -np.inf # A group can't end before it starts
+
+    # best[j] is the best score for gray values 0 to j split into the groups so far
+    best = score[0].copy()
+    choices = []
+    for _ in range(n - 1):
+        # Every way to end the previous groups at i and put i + 1 to j in a new group
+        options = best[:-1, None] + score[1:, :]
+        choice = np.argmax(options, axis=0)
+        best = options[choice, levels]
+        choices.append(choice)
+
+    # Walking back through the choices to find where each group ended
+    breaks = []
+    end = 255
+    for choice in reversed(choices):
+        end = int(choice[end])
+        breaks.append(end)
+
+    return fit_breaks(breaks[::-1])
+
+# Breaks from k-means on the gray values, each gray value counts as many times as it shows up
+def kmeans_breaks(histogram, n, iterations=50):
+    import numpy as np
+
+    levels = np.arange(256, dtype=np.float64)
+    histogram = np.asarray(histogram, dtype=np.float64)
+
+    # Starting the centers in the middle of equal sized groups
+    bounds = [-1] + quantile_breaks(histogram, n) + [255]
+    centers = np.array([(bounds[i] + bounds[i + 1] + 1) / 2 for i in range(n)])
+
+    for _ in range(iterations):
+        edges = (centers[:-1] + centers[1:]) / 2
+        labels = np.searchsorted(edges, levels)
+        counts = np.bincount(labels, weights=histogram, minlength=n)
+        totals = np.bincount(labels, weights=histogram * levels, minlength=n)
+        updated = np.where(counts > 0, totals / np.maximum(counts, 1), centers)
+        if np.allclose(updated, centers):
+            break
+        centers = np.sort(updated)
+
+    return fit_breaks(np.floor((centers[:-1] + centers[1:]) / 2))
+
+# Ways to place breaks automatically
+BREAK_METHODS = {
+    "Equal Areas": quantile_breaks,
+    "Otsu": otsu_breaks,
+    "K-Means": kmeans_breaks
+}
+
+# Places the breaks for n colors from a 256 bin histogram
+def auto_breaks(histogram, n, method="Equal Areas"):
+    return BREAK_METHODS[method](histogram, n)
+
+# Finds the main colors of an rgb image with k-means, gives back colors and grayscale breaks a painting can load
+def extract_palette(image, k=4, samples=20000, attempts=3, seed=0):
+    import numpy as np
+    import cv2
+
+    pixels = image.reshape(-1, 3)
+
+    # K-means only needs a random handful of the pixels to find the main colors
+    if len(pixels) > samples:
+        rng = np.random.default_rng(seed)
+        pixels = pixels[rng.integers(0, len(pixels), samples)]
+
+    pixels = np.float32(pixels)
+    k = max(2, min(k, len(np.unique(pixels, axis=0))))
+
+    cv2.setRNGSeed(seed)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+    _, _, centers = cv2.kmeans(pixels, k, None, criteria, attempts, cv2.KMEANS_PP_CENTERS)
+
+    # Sorting the colors from darkest to lightest so they line up with the grayscale breaks
+    grays = centers @ np.float32([0.299, 0.587, 0.114])
+    order = np.argsort(grays)
+    grays = grays[order]
+    centers = np.clip(np.rint(centers[order]), 0, 255).astype(int)
+
+    # Each break sits halfway between two neighboring colors
+    breaks = fit_breaks([(grays[i] + grays[i + 1]) // 2 for i in range(k - 1)])
+
+    colors = [tuple(int(c) for c in center) for center in centers]
+
+    return breaks, colors
+
+# Lookup table that gives the nearest palette color for every rgb value, made once per palette
+class PaletteCube:
+    def __init__(self, palette, bits=5):
+        import numpy as np
+
+        self.palette = np.asarray(palette, dtype=np.float32)
+        self.bits = bits # Each channel is cut down to this many bits so the cube stays small
+        self.shift = 8 - bits
+
+        # The middle of every cell in the cube
+        size = 1 << bits
+        middles = (np.arange(size, dtype=np.float32) + 0.5) * (1 << self.shift)
+        r, g, b = np.meshgrid(middles, middles, middles, indexing="ij")
+        cells = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+
+        # Nearest palette color for every cell
+        distances = ((cells[:, None, :] - self.palette[None, :, :]) ** 2).sum(axis=2)
+        self.cube = np.argmin(distances, axis=1).astype(np.uint8)
+
+    # Which cell of the cube each pixel falls in, only depends on the image so it can be kept between recolors
+    def index(self, image):
+        import numpy as np
+
+        image = image >> self.shift
+        index = image[:, :, 0].astype(np.int32) << (2 * self.bits)
+        index |= image[:, :, 1].astype(np.int32) << self.bits
+        index |= image[:, :, 2]
+        return index
+
+    # Palette number for each pixel
+    def labels(self, index):
+        import numpy as np
+
+        return np.take(self.cube, index)
+
+    # Paints each pixel with the color that goes with its nearest palette color, one lookup per pixel
+    def apply(self, index, colors):
+        import numpy as np
+
+        colors = np.asarray(colors, dtype=np.uint8)[:len(self.palette)]
+        return np.take(colors[self.cube], index, axis=0)
 
 # class Cluster:
 #     def __init__(self, image):
@@ -92,12 +230,17 @@ def grid(image, grid_size=(10, 10)):
 
 
 # --- Run ---
-image = cv2.imread("cat.jpeg")
+if __name__ == "__main__":
+    import cv2
+
+    image = cv2.imread("cat.jpeg")
 
-mosaic = grid(image, (10, 10))
+    mosaic = grid(image, (10, 10))
+
+    cv2.imwrite('new_mosaic.jpg', mosaic)
 
-cv2.imshow("win", mosaic)
-cv2.waitKey(0)
+    cv2.imshow("win", mosaic)
+    cv2.waitKey(0)
 
 # cf = Cluster(mosaic)
 # cf.to_hsv()
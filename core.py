@@ -0,0 +1,371 @@
+"""
+Image processing for the Andy Warhol Style Image Editor
+
+Nothing in here needs a window. Numpy, OpenCV and Pillow are only imported the
+first time a function needs them, so importing this module is quick.
+"""
+import functools
+import time
+
+# Converts a hex value to a rgb tuple
+def hex_to_rgb(hex_color):
+    hex_color = hex_color.lstrip('#')  # Remove '#' if present
+    return tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+
+# Converts an rgb tuple to a hex value
+def rgb_to_hex(rgb_color):
+    r, g, b = rgb_color
+    return f'#{int(r):02x}{int(g):02x}{int(b):02x}'
+
+# Return a smaller easier to work with image
+def compress_image(image, screen_size):
+    import cv2
+
+    screen_width, screen_height = screen_size
+
+    # Defining the max size of the image
+    screen_width = screen_width * 0.6
+    screen_height = screen_height * 0.6
+
+    height, width = image.shape[:2]
+
+    # The largest scale decides how much both dimensions shrink
+    scale = max(width / screen_width, height / screen_height)
+
+    # Images that already fit are given back as they are without copying
+    if scale <= 1:
+        return image
+
+    width = max(int(width // scale), 1)
+    height = max(int(height // scale), 1)
+
+    # Area averaging gives the cleanest result when shrinking, works for both grayscale and rgb
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+# Opens image as single channel grayscale, gives back the small and full size versions
+def open_gray_scale(file, screen_size):
+    import cv2
+
+    image_gs_simple = cv2.imread(file, 0)
+
+    return compress_image(image_gs_simple, screen_size), image_gs_simple
+
+# Opens image and converts it to rgb
+def open_to_rgb(file, screen_size):
+    import cv2
+
+    image_og = cv2.imread(file, 1)
+
+    image_og_compressed = compress_image(image_og, screen_size)
+
+    return cv2.cvtColor(image_og_compressed, cv2.COLOR_BGR2RGB)
+
+# Reads the file once and makes every version of the image a painting needs from it
+def load_images(file, screen_size):
+    import cv2
+
+    start = time.perf_counter()
+
+    image_og = cv2.imread(file, 1)
+    if image_og is None:
+        raise ValueError(f"Unable to open image: {file}")
+
+    decoded = time.perf_counter()
+
+    # Full size grayscale is only used when saving, it's kept as one channel to use a third of the memory
+    og_gs = cv2.cvtColor(image_og, cv2.COLOR_BGR2GRAY)
+
+    # The grayscale preview comes from the small rgb preview so the full size image only gets shrunk once
+    image_rgb = cv2.cvtColor(compress_image(image_og, screen_size), cv2.COLOR_BGR2RGB)
+    image_gs = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY)
+
+    derived = time.perf_counter()
+
+    # How long opening the image took in seconds
+    timings = {
+        "decode": decoded - start,
+        "derive": derived - decoded
+    }
+
+    return image_rgb, image_gs, og_gs, timings
+
+# Create color wheel for color picker, each size and background is only ever made once
+@functools.lru_cache(maxsize=None)
+def create_color_wheel(size=300, background=(36, 36, 36)):
+    import numpy as np
+    from PIL import Image
+
+    radius = size // 2
+
+    # Translating coords so (0,0) is at the center
+    y, x = np.mgrid[0:size, 0:size]
+    dx = x - radius
+    dy = y - radius
+
+    r = np.sqrt(dx * dx + dy * dy) / radius
+    inside = r <= 1 # Pixels inside the circle
+
+    theta = np.arctan2(dy, dx)
+    hue = (theta + np.pi) / (2 * np.pi) # Hue is defined by the degrees around the color wheel
+    sat = np.minimum(r, 1) # Saturation is defined by the distance from the center
+    val = np.ones_like(sat) # Value will be controlled by slider so the wheel will just have full value
+
+    # Same steps as colorsys.hsv_to_rgb but for every pixel at once
+    i = (hue * 6.0).astype(int)
+    f = (hue * 6.0) - i
+    p = val * (1.0 - sat)
+    q = val * (1.0 - sat * f)
+    t = val * (1.0 - sat * (1.0 - f))
+    i = i % 6
+
+    rgb = np.stack([
+        np.choose(i, [val, q, p, p, t, val]),
+        np.choose(i, [t, val, val, q, p, p]),
+        np.choose(i, [p, p, t, val, val, q])
+    ], axis=-1)
+
+    img = (rgb * 255).astype(np.uint8) # Turning hsv value into rgb for the actual pixels
+    img[~inside] = background # The color of the background
+
+    return Image.fromarray(img)
+
+# Builds a table that gives the color for each of the 256 gray values
+def create_lut(breaks, colors):
+    import numpy as np
+
+    lut = np.zeros((256, 3), dtype=np.uint8)
+
+    # Each color covers the range of gray values between its breaks
+    for i in range(len(colors)):
+        if i == 0: # First color
+            low, high = 0, breaks[i]
+        elif colors[i] == colors[-1]: # Last color
+            low, high = breaks[i - 1] + 1, 255
+        else: # Middle colors
+            low, high = breaks[i - 1] + 1, breaks[i]
+
+        # Breaks can be floats from the slider, they get capped and truncated like the masks used to do
+        low = int(min(low, 255))
+        high = int(min(high, 255))
+
+        # Overlapping ranges get or'd together like combined images did
+        lut[low:high + 1] |= np.array(colors[i], dtype=np.uint8)
+
+    return lut
+
+# How many pixels posterize looks up at a time
+LOOKUP_PIXELS = 1 << 20
+
+# Colors a grayscale image in one pass by looking every pixel up in the table
+def posterize(image, breaks, colors, out=None):
+    import numpy as np
+
+    lut = create_lut(breaks, colors)
+    if out is None:
+        out = np.empty(image.shape + (3,), dtype=np.uint8)
+
+    # Numpy turns the gray values into 8 byte indexes while looking them up, going a band of rows
+    # at a time keeps that copy small instead of 8 bytes for every pixel in the image
+    rows = max(1, LOOKUP_PIXELS // max(image.shape[1], 1))
+    for y in range(0, image.shape[0], rows):
+        np.take(lut, image[y:y + rows], axis=0, out=out[y:y + rows])
+
+    return out
+
+# Repainting more than this share of the pixels one by one is slower than posterizing everything again
+REPAINT_FRACTION = 0.25
+
+# Keeps the last posterized image and only repaints the pixels whose color changed
+class Posterizer:
+    def __init__(self, image):
+        self.image = image
+        self.flat = image.ravel()
+        self.lut = None # Table the image was last posterized with
+        self.out = None
+        self.order = None # Every pixel's position sorted by its gray value
+        self.offsets = None # Where each gray value starts in order
+        self.repainted = 0 # How many pixels the last render changed
+
+    # Gives back the posterized image, the same buffer is changed in place every time
+    def render(self, breaks, colors):
+        import numpy as np
+
+        lut = create_lut(breaks, colors)
+
+        if self.out is None:
+            self.out = posterize(self.image, breaks, colors)
+            self.lut = lut
+            self.repainted = self.flat.size
+            return self.out
+
+        # Only gray values whose color is different in the new table have to change
+        changed = np.flatnonzero((lut != self.lut).any(axis=1))
+        self.lut = lut
+
+        if changed.size == 0:
+            self.repainted = 0
+            return self.out
+
+        if self.order is None:
+            self._sort()
+
+        self.repainted = int((self.offsets[changed + 1] - self.offsets[changed]).sum())
+        if self.repainted > self.flat.size * REPAINT_FRACTION:
+            return posterize(self.image, breaks, colors, out=self.out)
+
+        # Gray values next to each other are repainted together, each run is one slice of order
+        flat_out = self.out.reshape(-1, 3)
+        splits = np.flatnonzero(np.diff(changed) > 1) + 1
+        for run in np.split(changed, splits):
+            pixels = self.order[self.offsets[run[0]]:self.offsets[run[-1] + 1]]
+            flat_out[pixels] = lut[self.flat[pixels]]
+
+        return self.out
+
+    # A counting sort of the pixels by gray value, only made the first time part of the image is repainted
+    def _sort(self):
+        import numpy as np
+
+        counts = np.bincount(self.flat, minlength=256)
+        self.offsets = np.zeros(257, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+
+        # A stable sort of 8 bit values is a radix sort in numpy
+        kind = np.int32 if self.flat.size < 2 ** 31 else np.int64
+        self.order = np.argsort(self.flat, kind="stable").astype(kind, copy=False)
+
+# Kept so older code that calls customize still works
+def customize(image, breaks, colors):
+    return posterize(image, breaks, colors)
+
+# How many (rows, columns) of panels a sheet needs, as square as possible unless the columns are given
+def sheet_layout(count, columns=None):
+    import math
+
+    columns = columns or math.ceil(math.sqrt(count))
+    columns = max(1, min(columns, count))
+    return math.ceil(count / columns), columns
+
+# Posterizes the grayscale image once for every (breaks, colors) preset, each one straight into its
+# panel of a single sheet, panels are spread over threads since numpy lets go of the GIL while looking up
+def panel_sheet(image, presets, columns=None, gap=0, background=(255, 255, 255), workers=None):
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not presets:
+        raise ValueError("A sheet needs at least one preset")
+
+    h, w = image.shape
+    rows, columns = sheet_layout(len(presets), columns)
+    sheet = np.empty((rows * h + (rows - 1) * gap, columns * w + (columns - 1) * gap, 3), dtype=np.uint8)
+
+    # Only the gaps and any empty panels need the background, every panel gets fully painted over
+    if gap or rows * columns > len(presets):
+        sheet[:] = background
+
+    def paint(i):
+        breaks, colors = presets[i]
+        y = (i // columns) * (h + gap)
+        x = (i % columns) * (w + gap)
+        posterize(image, breaks, colors, out=sheet[y:y + h, x:x + w])
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(paint, range(len(presets)))) # list() so errors from the threads come out here
+
+    return sheet
+
+# Part of the image on screen as (left, top, right, bottom) from 0 to 1, zoom 1 shows the whole image
+def zoom_rect(zoom, center):
+    size = 1 / zoom
+    left = min(max(center[0] - size / 2, 0), 1 - size)
+    top = min(max(center[1] - size / 2, 0), 1 - size)
+    return left, top, left + size, top + size
+
+# Cuts the part of the image inside rect out and sizes it to out_size
+def crop_view(image, rect, out_size):
+    import cv2
+
+    h, w = image.shape[:2]
+    x0 = min(int(rect[0] * w), w - 1)
+    y0 = min(int(rect[1] * h), h - 1)
+    x1 = max(int(round(rect[2] * w)), x0 + 1)
+    y1 = max(int(round(rect[3] * h)), y0 + 1)
+    crop = image[y0:y1, x0:x1]
+
+    if crop.shape[1] == out_size[0] and crop.shape[0] == out_size[1]:
+        return crop
+
+    # Shrinking averages pixels, zooming in past 1:1 shows the actual pixels as blocks
+    interpolation = cv2.INTER_AREA if crop.shape[1] > out_size[0] else cv2.INTER_NEAREST
+    return cv2.resize(crop, out_size, interpolation=interpolation)
+
+# Copies of an image at full, half, quarter... size, each one is only made the first time it's needed
+class Pyramid:
+    def __init__(self, image):
+        self.levels = [image]
+
+    def level(self, n):
+        import cv2
+
+        while len(self.levels) <= n:
+            h, w = self.levels[-1].shape[:2]
+            if h < 2 or w < 2: # Can't get any smaller
+                break
+            self.levels.append(cv2.resize(self.levels[-1], (w // 2, h // 2), interpolation=cv2.INTER_AREA))
+
+        return self.levels[min(n, len(self.levels) - 1)]
+
+    # The part of the image inside rect at out_size, cut from the smallest level that still has enough detail
+    def view(self, rect, out_size):
+        import math
+
+        w = self.levels[0].shape[1]
+        ratio = (rect[2] - rect[0]) * w / out_size[0] # Full size pixels for each pixel on screen
+        n = int(math.floor(math.log2(ratio))) if ratio > 1 else 0
+
+        return crop_view(self.level(n), rect, out_size)
+
+# Counts how many pixels have each of the 256 gray values
+def gray_histogram(image):
+    import numpy as np
+
+    return np.bincount(image.ravel(), minlength=256)
+
+# Averages the image in a grid of cells, gives back the small grid of cell colors and the full size mosaic
+def mosaic(image, grid_size=(10, 10)):
+    import numpy as np
+
+    h, w = image.shape[:2]
+    rows = max(1, min(grid_size[0], h))
+    cols = max(1, min(grid_size[1], w))
+
+    # Where each cell starts and ends, leftover rows and columns get spread out so none are dropped
+    ys = np.arange(rows + 1) * h // rows
+    xs = np.arange(cols + 1) * w // cols
+    cell_h = np.diff(ys)
+    cell_w = np.diff(xs)
+
+    # Adding up every cell a band of rows at a time, the sums need 8 bytes a value so doing the whole
+    # image at once would make a copy 8 times its size. Each band is added across the columns first,
+    # then each of its rows is added to the row of cells it belongs to
+    sums = np.zeros((rows, cols) + image.shape[2:], dtype=np.int64)
+    cell_of_row = np.repeat(np.arange(rows), cell_h)
+    band = max(1, LOOKUP_PIXELS // max(w, 1))
+    for y in range(0, h, band):
+        partial = np.add.reduceat(image[y:y + band], xs[:-1], axis=1, dtype=np.int64)
+        np.add.at(sums, cell_of_row[y:y + band], partial)
+
+    counts = np.outer(cell_h, cell_w)
+    if image.ndim == 3:
+        counts = counts[:, :, None]
+
+    cells = (sums // counts).astype(image.dtype) # Mean color of each cell
+
+    # Filling each cell of the mosaic with its mean color
+    mosaic_image = np.repeat(np.repeat(cells, cell_h, axis=0), cell_w, axis=1)
+
+    return cells, mosaic_image
+
+# Makes a mosaic of the image, kept for code that only wants the full size mosaic
+def grid(image, grid_size=(10, 10)):
+    return mosaic(image, grid_size)[1]
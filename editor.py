@@ -4,167 +4,63 @@ Engineer Your World
 By Benjamin "Tailwind" Garcia
 Last Updated 9/30/2025
 """
-import json
 import _tkinter
-import cv2
 import customtkinter as ctk
 from tkinter import filedialog
 from PIL import Image, ImageTk
-import eyw
 import numpy as np
-from io import BytesIO
 import colorsys
 import math
+import threading
+import traceback
+import time
+import argparse
+import sys
+import collections
+import concurrent.futures
+import os
+from core import rgb_to_hex, create_color_wheel, load_images, Posterizer, gray_histogram, zoom_rect, crop_view, Pyramid
+from export import export_image, export_sheet
+from presets import PresetStore
+from profiling import profiler
+from clustering import extract_palette, auto_breaks, BREAK_METHODS, PaletteCube
+
+# Most panels a sheet can have, the current colors plus eight presets makes a 3x3 sheet
+SHEET_PANELS = 9
+SHEET_GAP = 0 # Pixels between panels
+
+# How many changes can be undone and how many bytes of recent renders are kept to step back through
+HISTORY_LENGTH = 100
+RENDER_CACHE_BYTES = 256 * 1024 * 1024
 
 # Setting appearance for the window
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
 
-# Converts a hex value to a rgb tuple
-def hex_to_rgb(hex_color):
-    hex_color = hex_color.lstrip('#')  # Remove '#' if present
-    return tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+# Shows images through one PhotoImage that gets painted over, instead of a new image for every frame.
+# It's a plain canvas so its size is in real screen pixels and CustomTkinter never rescales what it shows
+class ImageView(ctk.CTkCanvas):
+    def __init__(self, master, size):
+        super().__init__(master, width=size[0], height=size[1], highlightthickness=0, borderwidth=0)
 
-# Converts an rgb tuple to a hex value
-def rgb_to_hex(rgb_color):
-    r, g, b = rgb_color
-    return f'#{int(r):02x}{int(g):02x}{int(b):02x}'
+        self.photo = ImageTk.PhotoImage("RGB", size, master=self)
+        self.item = self.create_image(0, 0, anchor="nw", image=self.photo)
 
-# Return a smaller easier to work with image
-def compress_image(image, screen_size, quality=100):
-    pil_image = Image.fromarray(image)
+    # Shows a rgb or single channel uint8 image
+    def show(self, image):
+        image = np.ascontiguousarray(image)
+        mode = "L" if image.ndim == 2 else "RGB"
+        size = (image.shape[1], image.shape[0])
 
-    screen_width, screen_height = screen_size
+        # Only happens if the size of the view changes
+        if size != (self.photo.width(), self.photo.height()):
+            self.photo = ImageTk.PhotoImage("RGB", size, master=self)
+            self.itemconfigure(self.item, image=self.photo)
+            self.configure(width=size[0], height=size[1])
 
-    # Defining the max size of the image
-    screen_width = screen_width * 0.6
-    screen_height = screen_height * 0.6
-
-    width, height = pil_image.size
-
-    # Finding the largest dimension and scaling both dimensions by that scale
-    if width >= screen_width and height >= screen_height:
-        width_scale = width/screen_width
-        height_scale = height/screen_height
-
-        if width_scale > height_scale:
-            width = width // width_scale
-            height = height // width_scale
-        else:
-            width = width // height_scale
-            height = height // height_scale
-
-    pil_image = pil_image.resize((int(width), int(height)))
-
-    # Saves the new smaller image to memory instead of disk
-    buffer = BytesIO()
-    pil_image.save(buffer, format="JPEG", quality=quality, optimize=True)
-    buffer.seek(0)
-
-    # Converts image to numpy array because that's what opencv uses
-    return np.array(Image.open(buffer))
-
-# Opens image and converts it to rgb grayscale
-def open_gray_scale(file, screen_size):
-    image_gs_simple = cv2.imread(file, 0)
-
-    image_gs_simple_compressed = compress_image(image_gs_simple, screen_size)
-
-    return cv2.cvtColor(image_gs_simple_compressed, cv2.COLOR_GRAY2RGB), cv2.cvtColor(image_gs_simple, cv2.COLOR_GRAY2RGB)
-
-# Opens image and converts it to rgb
-def open_to_rgb(file, screen_size):
-    image_og = cv2.imread(file, 1)
-
-    image_og_compressed = compress_image(image_og, screen_size)
-
-    return cv2.cvtColor(image_og_compressed, cv2.COLOR_BGR2RGB)
-
-# Creates papers, masks, and applies and combines them
-def customize(image, breaks, colors):
-
-    # Creating colored paper
-    papers = []
-    for color in colors:
-        papers.append(
-            eyw.create_colored_paper(image, color[0], color[1], color[2])
-        )
-
-    # Creating masks
-    masks = []
-
-    # Creating the masks based off the position of the color
-    for i in range(len(colors)):
-        if i == 0: # First color
-            masks.append(
-                eyw.create_mask(
-                    image,
-                    [0, 0, 0],
-                    [breaks[i], breaks[i], breaks[i]]
-                )
-            )
-        elif colors[i] == colors[-1]: # Last color
-            masks.append(
-                eyw.create_mask(
-                    image,
-                    [breaks[i - 1] + 1, breaks[i - 1] + 1, breaks[i - 1] + 1],
-                    [255, 255, 255]
-                )
-            )
-        else: # Middle colors
-            masks.append(
-                eyw.create_mask(
-                    image,
-                    [breaks[i-1] + 1, breaks[i-1] + 1, breaks[i-1] + 1],
-                    [breaks[i], breaks[i], breaks[i]]
-                )
-            )
-
-    # Combining applying masks
-    parts = []
-    for i in range(len(colors)):
-        parts.append(
-            eyw.apply_mask(papers[i], masks[i])
-        )
-
-    # Combing masks and colored paper
-    customized_image = eyw.combine_images(parts[0], parts[1])
-    for i in range(len(parts)):
-        if i >= 2:
-            customized_image = eyw.combine_images(customized_image, parts[i])
-
-    return customized_image
-
-# Turns image into a CTKImage
-def create_ctk_image(image):
-    pil_image = Image.fromarray(image)
-
-    return ctk.CTkImage(light_image=pil_image, dark_image=pil_image, size=pil_image.size)
-
-# Create color wheel for color picker
-def create_color_wheel(size=300):
-    radius = size // 2
-    img = np.zeros((size, size, 3), dtype=np.uint8)
-
-    for y in range(size):
-        for x in range(size):
-            # Translating coords so (0,0) is at the center
-            dx = x - radius
-            dy = y - radius
-
-            r = np.sqrt(dx * dx + dy * dy) / radius
-
-            if r <= 1:  # Inside circle
-                theta = np.arctan2(dy, dx)
-                hue = (theta + np.pi) / (2 * np.pi) # Hue is defined by the degrees around the color wheel
-                sat = r # Saturation is defined by the distance from the center
-                val = 1.0 # Value will be controlled by slider so the wheel will just have full value
-                rgb = colorsys.hsv_to_rgb(hue, sat, val) # Turning hsv value into rgb for the actual pixels
-                img[y, x] = [int(c * 255) for c in rgb] # Setting pixel value
-            if r > 1: # Outside circle
-                img[y, x] = [36,36,36] # The color of the background
-
-    return Image.fromarray(img)
+        # Grayscale arrays are wrapped without a copy. Pillow keeps rgb with a spare fourth byte per pixel,
+        # so rgb arrays get unpacked into it once, then paste writes that into the PhotoImage Tk already has
+        self.photo.paste(Image.frombuffer(mode, size, image, "raw", mode, 0, 1))
 
 class ColorPicker(ctk.CTkToplevel):
     def __init__(self, master=None, callback=None, size=300, color=(49, 107, 65)):
@@ -193,7 +89,7 @@ class ColorPicker(ctk.CTkToplevel):
         self.marker_id = None
 
         # Creating the color wheel and turning it into a usable image
-        wheel = create_color_wheel()
+        wheel = create_color_wheel(size)
         self.tk_img = ImageTk.PhotoImage(wheel)
 
         # Canvas to display wheel
@@ -410,9 +306,142 @@ class Color(ctk.CTkFrame):
         if self.position > 0 and self.position != selected:
             self.gs_button.configure(fg_color="#1F6AA5")
 
+# Renders images on a separate thread so the window doesn't freeze while sliders move
+class RenderScheduler:
+    def __init__(self, widget, render, callback, interval=16):
+        self.widget = widget # Any widget, used to get back onto the window's thread with after()
+        self.render = render # Runs on the worker thread
+        self.callback = callback # Gets the finished render on the window's thread
+        self.interval = interval # How often in ms to check for a finished render
+
+        self.condition = threading.Condition()
+        self.pending = None # Newest parameters that still need rendering
+        self.finished = None # Newest finished render
+        self.requested = 0 # Number given to the newest request
+        self.shown = 0 # Number of the newest render given to the callback
+        self.polling = False
+        self.closed = False
+
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    # Asks for a render, a burst of requests only renders the most recent one
+    def request(self, *params):
+        with self.condition:
+            self.requested += 1
+            self.pending = (self.requested, params)
+            self.condition.notify()
+
+        if not self.polling:
+            self.polling = True
+            self.widget.after(self.interval, self._poll)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.pending = None
+            self.condition.notify()
+
+    # Throws away every render that was asked for so far, used when the result is already known
+    def skip(self):
+        with self.condition:
+            self.requested += 1
+            self.pending = None
+            self.shown = self.requested
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+
+                if self.closed:
+                    return
+
+                number, params = self.pending
+                self.pending = None
+
+            try:
+                result = self.render(*params)
+            except Exception:
+                traceback.print_exc()
+                result = None
+
+            with self.condition:
+                self.finished = (number, result)
+
+    # Checks for finished renders on the window's thread
+    def _poll(self):
+        if self.closed:
+            self.polling = False
+            return
+
+        with self.condition:
+            finished = self.finished
+            self.finished = None
+
+        # Renders older than the one already shown are stale and get dropped
+        if finished is not None and finished[0] > self.shown:
+            self.shown = finished[0]
+            if finished[1] is not None:
+                self.callback(finished[1])
+
+        if self.shown < self.requested:
+            self.widget.after(self.interval, self._poll)
+        else:
+            self.polling = False
+
+# Opens every image a painting needs from its file, safe to run off the window's thread
+def prepare_painting(file_path, screen_size):
+    with profiler.stage("load_images") as details:
+        image_rgb, image_gs, og_gs, load_times = load_images(file_path, screen_size)
+        details.update(load_times)
+        details["bytes"] = image_rgb.nbytes + image_gs.nbytes + og_gs.nbytes
+
+    # Made once so placing breaks automatically never has to look at the pixels again
+    histogram = gray_histogram(og_gs)
+
+    return image_rgb, image_gs, og_gs, load_times, histogram
+
+# Recently rendered images by key, the least recently used ones go once they take more than budget bytes
+class RenderCache:
+    def __init__(self, budget):
+        self.budget = budget
+        self.items = collections.OrderedDict() # Key to (value, bytes), oldest first
+        self.size = 0
+
+    def get(self, key):
+        if key not in self.items:
+            return None
+
+        self.items.move_to_end(key)
+        return self.items[key][0]
+
+    def put(self, key, value, size):
+        if key in self.items:
+            self.size -= self.items.pop(key)[1]
+
+        if size > self.budget:
+            return
+
+        self.items[key] = (value, size)
+        self.size += size
+
+        while self.size > self.budget:
+            _, (_, old_size) = self.items.popitem(last=False)
+            self.size -= old_size
+
+    # Forgets everything rendered for one painting, keys start with the painting
+    def drop(self, owner):
+        for key in [key for key in self.items if key[0] is owner]:
+            self.size -= self.items.pop(key)[1]
+
+# Renders every painting shares
+render_cache = RenderCache(RENDER_CACHE_BYTES)
+
 # Class that holds and configures the images
 class Painting:
-    def __init__(self, file_path, root, screen_size, parent):
+    def __init__(self, file_path, root, screen_size, parent, prepared=None):
         self.breaks = [
             120
         ]
@@ -426,24 +455,53 @@ class Painting:
         # Takes something like "C:\Users\User\Photos\cat.jpeg" and extracts "cat.jpeg"
         self.name = file_path.split('/')[-1]
 
-        # Creating inital images
-        self.image_rgb = open_to_rgb(file_path, screen_size)
-        self.image_gs, self.og_gs = open_gray_scale(file_path, screen_size)
-        self.image_cstm = customize(self.image_gs, self.breaks, self.colors)
+        # Creating inital images, the app opens them on another thread and passes them in already made
+        if prepared is None:
+            prepared = prepare_painting(file_path, screen_size)
+        self.image_rgb, self.image_gs, self.og_gs, self.load_times, self.histogram = prepared
+
+        # Belongs to the render thread once it starts, it keeps its own buffer and only repaints what changed
+        self.posterizer = Posterizer(self.image_gs)
+        self.render_rect = (0, 0, 1, 1) # What the posterizer's image shows
+
+        with profiler.stage("posterize") as details:
+            self.image_cstm = self.posterizer.render(self.breaks, self.colors).copy()
+            details["bytes"] = self.image_cstm.nbytes
+
+        self.break_mode = "Manual"
 
         self.root = root
         self.parent = parent
 
-        self.images = [ # Images as CTKImages
-            ["Customized", create_ctk_image(self.image_cstm)],
-            ["Original", create_ctk_image(self.image_rgb)],
-            ["Gray Scale", create_ctk_image(self.image_gs)],
-        ]
+        # Re-renders happen off the window's thread
+        self.renderer = RenderScheduler(self.root, self._render, self._show_render)
+        self.requested_at = None # When the oldest change that isn't on screen yet was made
+
+        self.view_names = ["Customized", "Segmented", "Original", "Gray Scale"]
+
+        # Zooming, every view shows the part of the image inside view_rect at the preview's size
+        self.out_size = (self.image_gs.shape[1], self.image_gs.shape[0])
+        self.max_zoom = max(1.0, 8 * self.og_gs.shape[1] / self.out_size[0]) # Up to 8 screen pixels per image pixel
+        self.zoom = 1.0
+        self.center = (0.5, 0.5)
+        self.view_rect = zoom_rect(self.zoom, self.center) # What the newest render was asked to show
+        self.shown_rect = self.view_rect # What the images on screen show
+        self.view_gs = self.image_gs # Grayscale of the part on screen
+        self.pyramid = None # Made from the full size grayscale the first time the image is zoomed in
+        self.drag_start = None
+
+        # Full color segmentation, only made the first time the segmented view is shown
+        self.segment_cube = None
+        self.segment_count = 0 # How many colors the palette was found for
+        self.segment_index = None
+
+        # Images for the views are only made the first time a view is shown and kept until they change
+        self.views = {}
 
         self.color_buttons = []
         self.image_buttons = []
 
-        self.image_label = None # The label that is used for changing the displayed image
+        self.image_view = None # Where the displayed image is drawn
 
         self.current = None
 
@@ -451,14 +509,23 @@ class Painting:
 
         self.slider_gs = None
 
+        self.break_menu = None
+
+        self.overlay = None # Frame times, only shown while profiling
+
+        # Past breaks and colors for undo and redo, the images come from the render cache
+        self.history = [self._snapshot()]
+        self.history_index = 0
+
     def display(self):
-        if self.name not in self.root._tab_dict: #Checks if this painting already has a tab created
-            self.root.add(self.name)
+        if self.image_view is None: # Checks if this painting's frame has already been created
+            if self.name not in self.root._tab_dict: # The tab might already be there holding a loading message
+                self.root.add(self.name)
 
             frame = self._create_frame(self.root)
             frame.grid(row=0, column=0, sticky="nsew")
 
-            self._switch_image(self.images[0][0])
+            self._switch_image(self.view_names[0])
 
     def _create_frame(self, root):
         tab = root.tab(self.name)
@@ -487,15 +554,27 @@ class Painting:
         self.slider_gs = ctk.CTkSlider(master=slider_frame, from_=0, to=254, number_of_steps=254, command=self._update_gs)
         self.slider_gs.pack(side="left", padx=5)
 
+        # A drag only goes into the history once, when the slider is let go
+        self.slider_gs.bind("<ButtonRelease-1>", lambda event: self._record())
+
+        # Menu to choose how breaks are placed
+        self.break_menu = ctk.CTkOptionMenu(
+            master=slider_frame,
+            width=120,
+            values=["Manual"] + list(BREAK_METHODS),
+            command=self._set_break_mode
+        )
+        self.break_menu.pack(side="left", padx=5)
+
         # Creating a button for each image
-        for i in self.images:
+        for name in self.view_names:
             image_button = ctk.CTkButton(
                 master=button_frame,
-                text=i[0],
-                command=lambda x=i: self._switch_image(x[0])
+                text=name,
+                command=lambda x=name: self._switch_image(x)
             )
             image_button.pack(side="left", padx=5)
-            self.image_buttons.append([i[0], image_button])
+            self.image_buttons.append([name, image_button])
 
         # Button to save colors and grayscale breaks as a preset
         save_preset_button = ctk.CTkButton(
@@ -515,6 +594,32 @@ class Painting:
         )
         load_preset_button.pack(side="left", padx=5)
 
+        # Picking colors and breaks from the image's own main colors
+        auto_button = ctk.CTkButton(
+            master=button_frame,
+            width=100,
+            text="Auto Colors",
+            command=self._auto_colors
+        )
+        auto_button.pack(side="left", padx=5)
+
+        # Going back and forward through changes
+        undo_button = ctk.CTkButton(
+            master=button_frame,
+            width=60,
+            text="Undo",
+            command=self.undo
+        )
+        undo_button.pack(side="left", padx=5)
+
+        redo_button = ctk.CTkButton(
+            master=button_frame,
+            width=60,
+            text="Redo",
+            command=self.redo
+        )
+        redo_button.pack(side="left", padx=5)
+
         # Button to remove image
         remove_button = ctk.CTkButton(
             master=button_frame,
@@ -562,9 +667,30 @@ class Painting:
         sub_button.pack(side="right", padx=5)
 
         # Image row
-        self.current = self.images[0][0]
-        self.image_label = ctk.CTkLabel(master=image_frame, image=self.images[0][1], text="")
-        self.image_label.grid(row=3, column=0, pady=10, sticky="n")
+        # The image is drawn at the preview's size times the display scaling, worked out once here so
+        # renders already come out at the size they're shown at and never have to be scaled again
+        scaling = ctk.ScalingTracker.get_widget_scaling(image_frame)
+        out_size = (round(self.image_gs.shape[1] * scaling), round(self.image_gs.shape[0] * scaling))
+        if out_size != self.out_size:
+            self._set_out_size(out_size)
+
+        self.current = self.view_names[0]
+        self.image_view = ImageView(image_frame, self.out_size)
+        self.image_view.grid(row=3, column=0, pady=10, sticky="n")
+        self._update_current(self._get_view(self.current))
+
+        # Scrolling zooms in where the mouse is, dragging moves around, double clicking shows the whole image
+        self.image_view.bind("<MouseWheel>", lambda event: self._zoom_at(event, 1.25 if event.delta > 0 else 0.8))
+        self.image_view.bind("<Button-4>", lambda event: self._zoom_at(event, 1.25))
+        self.image_view.bind("<Button-5>", lambda event: self._zoom_at(event, 0.8))
+        self.image_view.bind("<ButtonPress-1>", self._start_drag)
+        self.image_view.bind("<B1-Motion>", self._drag)
+        self.image_view.bind("<Double-Button-1>", lambda event: self._set_view(1.0, (0.5, 0.5)))
+
+        # Frame time overlay when profiling is on
+        if profiler.enabled:
+            self.overlay = ctk.CTkLabel(master=image_frame, text="", justify="left", font=ctk.CTkFont(family="Courier", size=12))
+            self.overlay.grid(row=4, column=0, pady=5, sticky="n")
 
         return image_frame
 
@@ -588,6 +714,7 @@ class Painting:
                 self.breaks[-(i+1)] = self.breaks[-(i+1)] - 1
 
         self.breaks.append(254)
+        self._balance_breaks()
 
         self.color_buttons[-1].choose_grayscale()
 
@@ -601,14 +728,61 @@ class Painting:
             self.color_buttons.pop()
 
             self.breaks.pop()
+            self._balance_breaks()
 
             self.update_colors()
 
+    # Moves the breaks to where the chosen method puts them, manual breaks are left alone
+    def _balance_breaks(self):
+        if self.break_mode != "Manual":
+            self.breaks = auto_breaks(self.histogram, len(self.colors), self.break_mode)
+
+            if self.chosen_gs < len(self.breaks):
+                self.slider_gs.set(self.breaks[self.chosen_gs])
+
+    def _set_break_mode(self, mode):
+        self.break_mode = mode
+        self.break_menu.set(mode)
+
+        self._balance_breaks()
+        self._update_images()
+        self._record()
+
     def update_colors(self):
         for i in range(len(self.color_buttons)):
             self.colors[i] = self.color_buttons[i].color
 
         self._update_images()
+        self._record()
+
+    # Breaks, colors and how breaks are placed, as tuples so they can be compared and used as keys
+    def _snapshot(self):
+        return tuple(self.breaks), tuple(tuple(color) for color in self.colors), self.break_mode
+
+    # Adds the current look to the history, anything that was undone can't be redone anymore
+    def _record(self):
+        snapshot = self._snapshot()
+        if snapshot == self.history[self.history_index]:
+            return
+
+        del self.history[self.history_index + 1:]
+        self.history.append(snapshot)
+        del self.history[:-HISTORY_LENGTH]
+        self.history_index = len(self.history) - 1
+
+    def undo(self):
+        if self.history_index > 0:
+            self.history_index -= 1
+            self._restore(self.history[self.history_index])
+
+    def redo(self):
+        if self.history_index < len(self.history) - 1:
+            self.history_index += 1
+            self._restore(self.history[self.history_index])
+
+    def _restore(self, snapshot):
+        breaks, colors, break_mode = snapshot
+        self.load_preset(list(breaks), list(colors), break_mode)
 
     # Changes displayed image
     def _switch_image(self, image):
@@ -617,14 +791,79 @@ class Painting:
             if button[0] == image:
                 button[1].configure(fg_color="#0C2940")
 
-        for label in self.images:
-            if label[0] == image:
-                self.image_label.configure(image=label[1])
-                self.current = label[0]
+        if image in self.view_names:
+            self._update_current(self._get_view(image))
+            self.current = image
+
+    # Gives the image for a view, making it if it isn't cached
+    def _get_view(self, name):
+        if name not in self.views:
+            sources = {
+                "Customized": lambda: self.image_cstm,
+                "Segmented": lambda: crop_view(self._segment(), self.shown_rect, self.out_size),
+                "Original": lambda: crop_view(self.image_rgb, self.shown_rect, self.out_size),
+                "Gray Scale": lambda: self.view_gs # Single channel, it only becomes rgb when it's drawn
+            }
+            self.views[name] = sources[name]()
+
+        return self.views[name]
+
+    # Changes the size everything is rendered at, the new first render is done here since the render thread
+    # hasn't been asked for anything before the frame is made
+    def _set_out_size(self, out_size):
+        self.out_size = out_size
+        self.max_zoom = max(1.0, 8 * self.og_gs.shape[1] / self.out_size[0])
+        self.views = {}
+
+        self.render_rect = None
+        self.view_gs, self.image_cstm, self.shown_rect, key = self._render(self.breaks, self.colors, self.view_rect)
+
+    # Where the mouse is across and down the image from 0 to 1
+    def _mouse_position(self, event):
+        width = max(event.widget.winfo_width(), 1)
+        height = max(event.widget.winfo_height(), 1)
+        return min(max(event.x / width, 0), 1), min(max(event.y / height, 0), 1)
+
+    def _set_view(self, zoom, center):
+        self.zoom = zoom
+        self.view_rect = zoom_rect(zoom, center)
+
+        left, top, right, bottom = self.view_rect
+        self.center = ((left + right) / 2, (top + bottom) / 2)
+
+        self._update_images()
+
+    # Zooms in or out keeping the point under the mouse in the same place
+    def _zoom_at(self, event, factor):
+        x, y = self._mouse_position(event)
+        left, top, right, bottom = self.view_rect
+
+        point_x = left + x * (right - left)
+        point_y = top + y * (bottom - top)
+
+        zoom = min(max(self.zoom * factor, 1.0), self.max_zoom)
+        size = 1 / zoom
+
+        self._set_view(zoom, (point_x + (0.5 - x) * size, point_y + (0.5 - y) * size))
+
+    def _start_drag(self, event):
+        self.drag_start = (self._mouse_position(event), self.center)
+
+    def _drag(self, event):
+        if self.drag_start is None or self.zoom == 1.0:
+            return
+
+        (start_x, start_y), (center_x, center_y) = self.drag_start
+        x, y = self._mouse_position(event)
+        size = 1 / self.zoom
+
+        self._set_view(self.zoom, (center_x - (x - start_x) * size, center_y - (y - start_y) * size))
 
     # Changes the image currently viewed (Customized, Original. Grayscale)
     def _update_current(self, image):
-        self.image_label.configure(image=image)
+        with profiler.stage("display") as details:
+            self.image_view.show(image)
+            details["bytes"] = image.nbytes
 
     def _update_gs(self, value):
         break_max = 254
@@ -647,29 +886,138 @@ class Painting:
             value = break_min + 1
         self.slider_gs.set(value)
         self.breaks[self.chosen_gs] = value
-        self._update_images()
 
-    # Replaces images in self.images with new updated ones
-    def _update_images(self):
-        self.image_cstm = customize(self.image_gs, self.breaks, self.colors)
-        self.images = [  # Images as CTkImages
-            ["Customized", create_ctk_image(self.image_cstm)],
-            ["Original", create_ctk_image(self.image_rgb)],
-            ["Gray Scale", create_ctk_image(self.image_gs)],
-        ]
-        if self.current == self.images[0][0]:
-            self._update_current(self.images[0][1])
+        # Moving a break by hand stops it from being placed automatically
+        if self.break_mode != "Manual":
+            self.break_mode = "Manual"
+            self.break_menu.set("Manual")
 
-    # Returns image if given the classes name
-    def get_image(self, name):
-        if name == self.name:
-            return customize(self.og_gs, self.breaks, self.colors)
-        return None
+        self._update_images()
 
-    def load_preset(self, breaks, colors):
+    # Asks for a new customized image with the current breaks and colors, recent ones come straight from the cache
+    def _update_images(self):
+        if self.requested_at is None:
+            self.requested_at = time.perf_counter()
+
+        cached = render_cache.get(self._render_key(self.breaks, self.colors, self.view_rect))
+        if cached is not None:
+            self.renderer.skip() # Anything still rendering is older than this
+            self._show_render(cached)
+            return
+
+        self.renderer.request(list(self.breaks), list(self.colors), self.view_rect)
+
+    def _render_key(self, breaks, colors, rect):
+        return self, rect, tuple(breaks), tuple(tuple(color) for color in colors)
+
+    # Runs on the render thread, only the part of the image on screen gets posterized
+    def _render(self, breaks, colors, rect):
+        # A new part of the image has to be posterized from scratch, otherwise only the changed pixels are
+        if rect != self.render_rect:
+            # The preview can be used as it is unless the display scaling made the view a different size
+            if rect == (0, 0, 1, 1) and self.image_gs.shape[1::-1] == self.out_size:
+                view_gs = self.image_gs
+            else:
+                if self.pyramid is None:
+                    self.pyramid = Pyramid(self.og_gs)
+
+                with profiler.stage("view") as details:
+                    view_gs = self.pyramid.view(rect, self.out_size)
+                    details["bytes"] = view_gs.nbytes
+
+            self.posterizer = Posterizer(view_gs)
+            self.render_rect = rect
+
+        with profiler.stage("posterize") as details:
+            # The window gets a copy since the posterizer keeps painting over its own buffer
+            image_cstm = self.posterizer.render(breaks, colors).copy()
+            details["bytes"] = image_cstm.nbytes
+            details["pixels"] = self.posterizer.repainted
+
+        return self.posterizer.image, image_cstm, rect, self._render_key(breaks, colors, rect)
+
+    # Colors the image by nearest palette color instead of by gray value
+    def _segment(self):
+        # The palette only has to be found again when the number of colors changes
+        if self.segment_cube is None or self.segment_count != len(self.colors):
+            _, palette = extract_palette(self.image_rgb, k=len(self.colors))
+            self.segment_cube = PaletteCube(palette)
+            self.segment_count = len(self.colors)
+
+        if self.segment_index is None:
+            self.segment_index = self.segment_cube.index(self.image_rgb)
+
+        return self.segment_cube.apply(self.segment_index, self.colors)
+
+    # Replaces the images that use the colors, the other views never change so they stay cached
+    def _show_render(self, result):
+        self.view_gs, self.image_cstm, rect, key = result
+        render_cache.put(key, result, self.view_gs.nbytes + self.image_cstm.nbytes)
+
+        # Moving the view changes every image so whichever one is showing gets redrawn,
+        # otherwise only the ones that use the colors change
+        if rect != self.shown_rect:
+            self.shown_rect = rect
+            self.views = {}
+            self._update_current(self._get_view(self.current))
+        else:
+            self.views.pop("Customized", None)
+            self.views.pop("Segmented", None)
+
+            if self.current in ("Customized", "Segmented"):
+                self._update_current(self._get_view(self.current))
+
+        # Time from the change to it being on screen
+        if self.requested_at is not None:
+            profiler.add("frame", self.requested_at, time.perf_counter())
+            self.requested_at = None
+
+        self._update_overlay()
+
+    def _update_overlay(self):
+        if self.overlay is None:
+            return
+
+        lines = []
+        for name in ("frame", "posterize", "display"):
+            values = profiler.percentiles(name)
+            if values:
+                lines.append(f"{name} p50 {values[50] * 1000:.1f}ms p95 {values[95] * 1000:.1f}ms")
+
+        self.overlay.configure(text="\n".join(lines))
+
+    # Stops the painting's render thread and lets go of its cached renders
+    def close(self):
+        self.renderer.close()
+        render_cache.drop(self)
+
+    # Saves the full size customized image a strip at a time
+    def export(self, filename):
+        with profiler.stage("export") as details:
+            export_image(self.og_gs, self.breaks, self.colors, filename)
+            details["bytes"] = self.og_gs.nbytes * 3
+
+    # Saves the full size image once for every (breaks, colors) preset as panels of one sheet
+    def export_sheet(self, filename, presets):
+        with profiler.stage("export_sheet") as details:
+            export_sheet(self.og_gs, presets, filename, gap=SHEET_GAP)
+            details["bytes"] = self.og_gs.nbytes * 3 * len(presets)
+            details["panels"] = len(presets)
+
+    # Loads colors found by k-means, keeping the same number of colors
+    def _auto_colors(self):
+        breaks, colors = extract_palette(self.image_rgb, k=len(self.colors))
+        self.load_preset(breaks, colors)
+
+    def load_preset(self, breaks, colors, break_mode="Manual"):
         self.breaks = breaks
         self.colors = colors
 
+        # Presets come with their own breaks
+        self.break_mode = break_mode
+        if self.break_menu is not None:
+            self.break_menu.set(break_mode)
+
         for button in self.color_buttons:
             button.destroy()
 
@@ -710,8 +1058,9 @@ class Help(ctk.CTkToplevel):
 
         textbox.insert(0.0, text)
 
+# Only makes buttons for the presets that fit in the window, scrolling reuses them for other presets
 class Presets(ctk.CTkToplevel):
-    def __init__(self, master, presets, callback=None, remove_callback=None, width=250, height=400):
+    def __init__(self, master, presets, callback=None, remove_callback=None, width=250, height=400, row_height=48):
         super().__init__(master=master)
 
         self.callback = callback
@@ -722,13 +1071,34 @@ class Presets(ctk.CTkToplevel):
         self.lift()  # Bring above other windows
         self.focus_force()  # Force focus
 
-        self.scroll = ctk.CTkScrollableFrame(master=self, width=width - 10, height=height - 10, )
-        self.scroll.pack(padx=10, pady=10)
+        self.row_height = row_height
 
         self.presets = presets
-        self.items = []
+        self.shown = list(presets) # Presets that match the search
+        self.query = ""
+        self.top = 0 # Position in self.shown of the first visible row
+
+        # Typing filters the presets by name
+        self.search = ctk.CTkEntry(master=self, placeholder_text="Search")
+        self.search.pack(side="top", fill="x", padx=10, pady=(10, 0))
+        self.search.bind("<KeyRelease>", lambda event: self.filter(self.search.get()))
+
+        list_frame = ctk.CTkFrame(master=self, fg_color="transparent")
+        list_frame.pack(side="top", fill="both", expand=True, padx=10, pady=10)
 
-        self.create_buttons()
+        self.scrollbar = ctk.CTkScrollbar(master=list_frame, command=self._scroll)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.rows_frame = ctk.CTkFrame(master=list_frame, fg_color="transparent")
+        self.rows_frame.pack(side="left", fill="both", expand=True)
+        self.rows_frame.grid_columnconfigure(0, weight=1)
+        self.rows_frame.bind("<Configure>", self._fit_rows)
+
+        self._bind_wheel(self.rows_frame)
+
+        self.rows = [] # Reused rows, each one is [frame, preset button, delete button]
+        self._add_rows(height // row_height + 1)
+        self._draw()
 
     def choose(self, config):
         if self.callback:  # The callback that returns the color data
@@ -739,23 +1109,41 @@ class Presets(ctk.CTkToplevel):
         if self.remove_callback:  # The callback that returns the color data
             self.remove_callback(preset)
 
-    def update_presets(self, presets):
-        for button in self.items:
-            button.destroy()
-
-        self.presets = presets
-
-        self.create_buttons()
-
-    def create_buttons(self):
-        for preset in self.presets:
-            preset_frame = ctk.CTkFrame(master=self.scroll)
-            preset_frame.pack(side="top", padx=10, pady=10)
+    # Takes a deleted preset out of the list, only the visible rows get redrawn
+    def remove_row(self, preset):
+        for presets in (self.presets, self.shown):
+            if preset in presets: # Other presets can have the same name, only this one goes
+                presets.remove(preset)
+        self._draw()
+
+    # Shows only the presets with the text in their name, typing more only searches the last results
+    def filter(self, query):
+        query = query.lower()
+        if query == self.query:
+            return
+
+        source = self.shown if query.startswith(self.query) else self.presets
+        self.shown = self._matches(source, query)
+        self.query = query
+        self.top = 0
+        self._draw()
+
+    def _matches(self, presets, query):
+        if not query:
+            return list(presets)
+        return [preset for preset in presets if query in preset["name"].lower()]
+
+    def _add_rows(self, count):
+        for _ in range(count):
+            position = len(self.rows)
+
+            preset_frame = ctk.CTkFrame(master=self.rows_frame, height=self.row_height - 8)
+            preset_frame.grid(row=position, column=0, sticky="ew", pady=4)
 
             preset_button = ctk.CTkButton(
                 master=preset_frame,
-                text=preset["name"],
-                command=lambda x=preset["config"]: self.choose(x)
+                text="",
+                command=lambda x=position: self._choose_row(x)
             )
             preset_button.pack(side="left", padx=5, pady=5)
 
@@ -764,14 +1152,77 @@ class Presets(ctk.CTkToplevel):
                 width=28,
                 fg_color="#ff0000",
                 text="X",
-                command=lambda x=preset: self.remove(x)
+                command=lambda x=position: self._remove_row(x)
             )
             delete_button.pack(side="right", padx=5, pady=5)
 
-            self.items.append(preset_frame)
-            self.items.append(preset_button)
-            self.items.append(delete_button)
+            for widget in (preset_frame, preset_button, delete_button):
+                self._bind_wheel(widget)
+
+            self.rows.append([preset_frame, preset_button, delete_button])
+
+    # Scrolling with the mouse wheel on Windows/macOS and on Linux
+    def _bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", lambda event: self._scroll("scroll", -1 if event.delta > 0 else 1, "units"))
+        widget.bind("<Button-4>", lambda event: self._scroll("scroll", -1, "units"))
+        widget.bind("<Button-5>", lambda event: self._scroll("scroll", 1, "units"))
+
+    # Makes more rows if the window got taller and keeps the scrollbar matching the height
+    def _fit_rows(self, event):
+        needed = event.height // self.row_height + 1
+        if needed > len(self.rows):
+            self._add_rows(needed - len(self.rows))
+
+        self._draw()
+
+    def _visible(self):
+        return max(1, self.rows_frame.winfo_height() // self.row_height)
+
+    # Puts the presets starting at self.top into the rows and hides the rows that aren't needed
+    def _draw(self):
+        self.top = max(0, min(self.top, len(self.shown) - self._visible()))
+
+        for position, (preset_frame, preset_button, _) in enumerate(self.rows):
+            index = self.top + position
+            if index < len(self.shown):
+                preset_button.configure(text=self.shown[index]["name"])
+                preset_frame.grid()
+            else:
+                preset_frame.grid_remove()
+
+        # Updating the scrollbar to show which part of the list is visible
+        if self.shown:
+            first = self.top / len(self.shown)
+            last = min(1.0, (self.top + self._visible()) / len(self.shown))
+            self.scrollbar.set(first, last)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _row_preset(self, position):
+        index = self.top + position
+        if index < len(self.shown):
+            return self.shown[index]
+        return None
 
+    def _choose_row(self, position):
+        preset = self._row_preset(position)
+        if preset is not None:
+            self.choose(preset["config"])
+
+    def _remove_row(self, position):
+        preset = self._row_preset(position)
+        if preset is not None:
+            self.remove(preset)
+
+    # Handles the scrollbar being dragged or clicked and the mouse wheel
+    def _scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.top = int(float(amount) * len(self.shown))
+        elif unit == "pages":
+            self.top += int(amount) * self._visible()
+        else:
+            self.top += int(amount)
+        self._draw()
 
     # Class that controls the general app
 class App(ctk.CTkToplevel):
@@ -790,6 +1241,9 @@ class App(ctk.CTkToplevel):
         save_button = ctk.CTkButton(master=button_frame, text="Save", command=self._save)
         save_button.pack(side="left", padx=5)
 
+        sheet_button = ctk.CTkButton(master=button_frame, text="Save Sheet", command=self._save_sheet)
+        sheet_button.pack(side="left", padx=5)
+
         help_button = ctk.CTkButton(master=button_frame, width=48, text="Help", command=self._help)
         help_button.pack(side="right", padx=5)
 
@@ -801,36 +1255,154 @@ class App(ctk.CTkToplevel):
 
         self.paintings = []
 
-    # Prompts user to select an image
+        # A broken presets file shouldn't stop the editor from opening, saving and loading presets
+        # keep reporting it until it's fixed and the file itself is never written over
+        try:
+            self.presets = PresetStore('presets.json')
+        except ValueError as error:
+            print(f"Unable to read presets.json, starting without presets: {error}", file=sys.stderr)
+            self.presets = PresetStore('presets.json', read=False)
+
+        # Files are opened on other threads, OpenCV lets go of the GIL while it decodes so they really run together
+        self.loader = concurrent.futures.ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+        self.loading = {} # Tab name to (file, future, loading frame) for files that are still opening
+        self.checking = False
+
+        self.protocol("WM_DELETE_WINDOW", self._close)
+
+        # Undo and redo for the open image
+        self.bind("<Control-z>", lambda event: self._step_history(-1))
+        self.bind("<Control-y>", lambda event: self._step_history(1))
+        self.bind("<Control-Z>", lambda event: self._step_history(1)) # Control+Shift+Z
+
+    # Prompts user to select images, each one gets a tab right away and fills in once it's opened
     def _open(self):
-        file = filedialog.askopenfilename(
-            title="Select a file",
+        files = filedialog.askopenfilenames(
+            title="Select files",
             filetypes=[("Image Files", "*.png *.jpg *.jpeg")]
         )
 
-        # Creates a new Painting object with the selected file
-        if file:
-            self.paintings.append(Painting(file, self.tab_view, self.screen_size, self))
-            self._display()
-            self.tab_view.set(file.split('/')[-1])
+        for file in files:
+            # Takes something like "C:\Users\User\Photos\cat.jpeg" and extracts "cat.jpeg"
+            name = file.split('/')[-1]
+            if name in self.tab_view._tab_dict: # Already open or opening
+                continue
+
+            tab = self.tab_view.add(name)
+            tab.grid_columnconfigure(0, weight=1)
+
+            # Shown in the tab until the image is ready
+            loading_frame = ctk.CTkFrame(tab, fg_color="transparent")
+            loading_frame.grid(row=0, column=0, pady=40, sticky="n")
+
+            loading_label = ctk.CTkLabel(master=loading_frame, text=f"Opening {name}...")
+            loading_label.pack(side="top", pady=10)
+
+            cancel_button = ctk.CTkButton(
+                master=loading_frame,
+                width=100,
+                text="Cancel",
+                command=lambda x=name: self.cancel_loading(x)
+            )
+            cancel_button.pack(side="top", pady=10)
+
+            future = self.loader.submit(prepare_painting, file, self.screen_size)
+            self.loading[name] = (file, future, loading_frame)
+
+        if files:
+            self.tab_view.set(files[0].split('/')[-1])
+
+        if self.loading and not self.checking:
+            self.checking = True
+            self.after(50, self._check_loading)
+
+    # Turns every file that finished opening into a painting in its tab
+    def _check_loading(self):
+        for name, (file, future, loading_frame) in list(self.loading.items()):
+            if not future.done():
+                continue
+
+            del self.loading[name]
+
+            try:
+                prepared = future.result()
+            except Exception as error:
+                # The tab stays with the error until the user closes it
+                for widget in loading_frame.winfo_children():
+                    widget.destroy()
+                ctk.CTkLabel(master=loading_frame, text=f"Unable to open {name}: {error}").pack(side="top", pady=10)
+                ctk.CTkButton(
+                    master=loading_frame,
+                    width=100,
+                    text="Close",
+                    command=lambda x=name: self.tab_view.delete(x)
+                ).pack(side="top", pady=10)
+                continue
+
+            loading_frame.destroy()
+            painting = Painting(file, self.tab_view, self.screen_size, self, prepared)
+            self.paintings.append(painting)
+            painting.display()
+
+        if self.loading:
+            self.after(50, self._check_loading)
+        else:
+            self.checking = False
+
+    # Stops a file from opening, files that haven't started are skipped and ones already opening get thrown away
+    def cancel_loading(self, name):
+        file, future, loading_frame = self.loading.pop(name)
+        future.cancel()
+        self.tab_view.delete(name)
+
+    def _close(self):
+        # Files that haven't started opening are dropped instead of holding up the exit
+        self.loader.shutdown(wait=False, cancel_futures=True)
+        for painting in self.paintings:
+            painting.close()
+        self.master.destroy()
 
     def _save(self):
         current = self.tab_view.get() # Getting current open image
         if current != "":
-            image = None
-            for painting in self.paintings: # Asking each painting for their image
-                response = painting.get_image(current)
-                if isinstance(response, np.ndarray):
-                    image = Image.fromarray(response) # Converting numpy.ndarray into valid image format
-
-            # Asking user where to save image and what to call it
-            filename = filedialog.asksaveasfilename(
-                defaultextension=".png",
-                filetypes=[("Image Files", "*.png *.jpg *.jpeg")]
-            )
+            for painting in self.paintings: # Finding the painting for the open tab
+                if painting.name == current:
+                    # Asking user where to save image and what to call it
+                    filename = filedialog.asksaveasfilename(
+                        defaultextension=".png",
+                        filetypes=[("Image Files", "*.png *.jpg *.jpeg *.tif *.tiff")]
+                    )
+
+                    # Save the image, nothing happens if the user cancels
+                    if filename:
+                        painting.export(filename)
+
+    def _step_history(self, step):
+        current = self.tab_view.get()
+        for painting in self.paintings:
+            if painting.name == current:
+                if step < 0:
+                    painting.undo()
+                else:
+                    painting.redo()
+
+    # Saves the open image as a sheet of panels, its current colors first and then the saved presets
+    def _save_sheet(self):
+        current = self.tab_view.get()
+        for painting in self.paintings:
+            if painting.name == current:
+                self.presets.refresh()
+                presets = [(painting.breaks, painting.colors)]
+                for preset in self.presets.items()[:SHEET_PANELS - 1]:
+                    presets.append((preset["config"]["breaks"], preset["config"]["colors"]))
+
+                filename = filedialog.asksaveasfilename(
+                    defaultextension=".png",
+                    filetypes=[("Image Files", "*.png *.jpg *.jpeg *.tif *.tiff")]
+                )
 
-            # Save the image
-            image.save(filename)
+                if filename:
+                    painting.export_sheet(filename, presets)
 
     def _help(self):
         try:
@@ -850,6 +1422,7 @@ class App(ctk.CTkToplevel):
 
     # Remove a painting from display
     def remove(self, painting):
+        painting.close()
         self.paintings.remove(painting)
         self.tab_view.delete(painting.name)
 
@@ -864,59 +1437,28 @@ class App(ctk.CTkToplevel):
         preset_name = prompt.get_input()
 
         if preset_name is not None: # If the user cancels or exits it will not save the preset
-            filename = 'presets.json'
-
-            existing_data = []
-
-            # Get the existing presets
-            try:
-                with open(filename, 'r') as file:
-                    existing_data = json.load(file)
-            except FileNotFoundError:
-                pass
-
-            # Add new preset
-            existing_data.append({
-                "name": preset_name,
-                "config": data
-            })
-
-            # Update presets.json
-            with open(filename, 'w') as file:
-                json.dump(existing_data, file, indent=4)
+            self.presets.save(preset_name, data)
 
     def load_preset(self, painting):
-        # Name of the file that presets are named in
-        filename = 'presets.json'
-
-        presets = []
-
-        # Get the preset list
-        try:
-            with open(filename, 'r') as file:
-                presets = json.load(file)
-        except FileNotFoundError:
-            pass
+        # Picking up presets saved by anything else since the last time
+        self.presets.refresh()
 
-        preset_window = Presets(master=self, presets=presets)
+        preset_window = Presets(master=self, presets=self.presets.items())
 
         # Callback when a preset gets picked
         def on_preset_picked(config):
-            breaks = config["breaks"]
-            colors = config["colors"]
+            # Copies so the painting can change them without changing the preset
+            breaks = list(config["breaks"])
+            colors = list(config["colors"])
 
             painting.load_preset(breaks, colors)
 
         # Callback when a preset gets deleted
         def remove_preset(preset):
-            presets.remove(preset) # Remove the deleted preset
-
-            # Update presets.json
-            with open(filename, 'w') as file:
-                json.dump(presets, file, indent=4)
+            self.presets.delete(preset["name"], preset["config"])
 
-            # Return the updated preset list
-            preset_window.update_presets(presets)
+            # Only the deleted preset's row goes away
+            preset_window.remove_row(preset)
 
         preset_window.callback = on_preset_picked
         preset_window.remove_callback = remove_preset
@@ -934,5 +1476,14 @@ class Root(ctk.CTk):
         app.state("zoomed")
         app.mainloop()
 
-root = Root()
-root.create_app()
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Andy Warhol Image Maker")
+    parser.add_argument("--profile", action="store_true", help="time each stage, show frame times and save a trace on exit")
+    parser.add_argument("--trace", help="file to save the Chrome trace to, turns on profiling")
+    args = parser.parse_args()
+
+    if args.profile or args.trace:
+        profiler.enable(args.trace)
+
+    root = Root()
+    root.create_app()
\ No newline at end of file
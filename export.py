@@ -0,0 +1,157 @@
+"""
+Saving posterized images for the Andy Warhol Style Image Editor
+
+Full size images are posterized a strip of rows at a time and each strip is
+written to the file before the next one is made, so saving a huge image only
+ever holds one strip of color in memory. PNG and TIFF files are written this
+way, other formats are saved in one go with OpenCV. Panel sheets are painted
+into one image with every preset and then saved the same ways.
+"""
+import os
+import struct
+import zlib
+from core import posterize, panel_sheet
+
+# How many bytes of color a strip is allowed to use
+STRIP_BUDGET = 16 * 1024 * 1024
+
+# Posterizes the image one strip of rows at a time, every strip reuses the same buffer
+def posterize_strips(image, breaks, colors, rows):
+    import numpy as np
+
+    height, width = image.shape
+    strip = np.empty((rows, width, 3), dtype=np.uint8)
+
+    for y in range(0, height, rows):
+        part = image[y:y + rows]
+        # posterize looks strips up in small bands so the lookup never needs much more than the strip
+        yield posterize(part, breaks, colors, out=strip[:len(part)])
+
+# Adds one chunk to a png file
+def _write_png_chunk(file, kind, data):
+    file.write(struct.pack(">I", len(data)))
+    file.write(kind)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+# Writes rgb strips to a png, compressing each one as it comes in
+def write_png(filename, width, height, strips, level=6):
+    import numpy as np
+
+    compressor = zlib.compressobj(level)
+
+    with open(filename, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        _write_png_chunk(file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+        for strip in strips:
+            # Every row starts with a byte saying which png filter it uses, 0 means none
+            rows = np.zeros((len(strip), 1 + width * 3), dtype=np.uint8)
+            rows[:, 1:] = strip.reshape(len(strip), -1)
+
+            data = compressor.compress(rows)
+            if data:
+                _write_png_chunk(file, b"IDAT", data)
+
+        _write_png_chunk(file, b"IDAT", compressor.flush())
+        _write_png_chunk(file, b"IEND", b"")
+
+# Writes rgb strips to a deflate compressed tiff, every strip except the last needs rows_per_strip rows
+def write_tiff(filename, width, height, strips, rows_per_strip, level=6):
+    offsets = []
+    counts = []
+
+    with open(filename, "wb") as file:
+        # Little endian header, the position of the tag directory gets filled in at the end
+        file.write(b"II*\x00\x00\x00\x00\x00")
+
+        for strip in strips:
+            data = zlib.compress(strip, level)
+            offsets.append(file.tell())
+            counts.append(len(data))
+            file.write(data)
+            if file.tell() % 2: # Everything after the strips has to start on an even byte
+                file.write(b"\x00")
+
+        if file.tell() > 0xFFFFFFFF:
+            raise ValueError("Image is too large for a tiff file, save it as a png instead")
+
+        # Values that don't fit in a tag go after the tag directory
+        tags = [
+            (256, 4, 1, width), # Image width
+            (257, 4, 1, height), # Image height
+            (258, 3, 3, struct.pack("<HHH", 8, 8, 8)), # Bits per sample
+            (259, 3, 1, 8), # Deflate compression
+            (262, 3, 1, 2), # Rgb
+            (273, 4, len(offsets), struct.pack(f"<{len(offsets)}I", *offsets)), # Strip offsets
+            (277, 3, 1, 3), # Samples per pixel
+            (278, 4, 1, rows_per_strip), # Rows per strip
+            (279, 4, len(counts), struct.pack(f"<{len(counts)}I", *counts)), # Strip byte counts
+            (284, 3, 1, 1), # Channels are stored together
+        ]
+
+        directory = file.tell()
+        extra = directory + 2 + len(tags) * 12 + 4
+        entries = b""
+        extra_data = b""
+
+        for tag, kind, count, value in tags:
+            if isinstance(value, bytes):
+                if len(value) <= 4:
+                    entries += struct.pack("<HHI", tag, kind, count) + value.ljust(4, b"\x00")
+                else:
+                    entries += struct.pack("<HHII", tag, kind, count, extra + len(extra_data))
+                    extra_data += value
+            elif kind == 3:
+                entries += struct.pack("<HHIHH", tag, kind, count, value, 0)
+            else:
+                entries += struct.pack("<HHII", tag, kind, count, value)
+
+        file.write(struct.pack("<H", len(tags)) + entries + struct.pack("<I", 0) + extra_data)
+
+        file.seek(4)
+        file.write(struct.pack("<I", directory))
+
+# Saves the posterized version of a grayscale image, png and tiff files never hold more than one strip in memory
+def export_image(image, breaks, colors, filename, budget=STRIP_BUDGET):
+    height, width = image.shape[:2]
+    rows = max(1, min(height, budget // (width * 3)))
+    extension = os.path.splitext(filename)[1].lower()
+
+    strips = posterize_strips(image, breaks, colors, rows)
+
+    if extension == ".png":
+        write_png(filename, width, height, strips)
+    elif extension in (".tif", ".tiff"):
+        write_tiff(filename, width, height, strips, rows)
+    else:
+        import cv2
+
+        # Other formats can't be written a piece at a time, colors are flipped to the bgr order opencv saves in
+        image_cstm = posterize(image, breaks, [color[::-1] for color in colors])
+        if not cv2.imwrite(filename, image_cstm):
+            raise ValueError(f"Unable to save image: {filename}")
+
+# Saves a sheet with one panel for each (breaks, colors) preset, like a Warhol print
+def export_sheet(image, presets, filename, columns=None, gap=0, budget=STRIP_BUDGET):
+    extension = os.path.splitext(filename)[1].lower()
+
+    if extension in (".png", ".tif", ".tiff"):
+        sheet = panel_sheet(image, presets, columns, gap)
+        height, width = sheet.shape[:2]
+        rows = max(1, min(height, budget // (width * 3)))
+
+        # The sheet is already made, strips are just views of it for the writers
+        strips = (sheet[y:y + rows] for y in range(0, height, rows))
+
+        if extension == ".png":
+            write_png(filename, width, height, strips)
+        else:
+            write_tiff(filename, width, height, strips, rows)
+    else:
+        import cv2
+
+        # Painting the panels with bgr colors means the sheet can be saved by opencv without converting it
+        sheet = panel_sheet(image, [(breaks, [color[::-1] for color in colors]) for breaks, colors in presets], columns, gap)
+        if not cv2.imwrite(filename, sheet):
+            raise ValueError(f"Unable to save image: {filename}")
@@ -0,0 +1,124 @@
+"""
+Saved presets for the Andy Warhol Style Image Editor
+
+The presets file is read once and kept in memory in the order presets were
+saved, with an index of the newest preset for each name. Saving always adds a
+preset, so more than one preset can have a name and all of them are kept.
+Changes are written to a temporary file that then replaces presets.json, so
+the file is never left half written, and the file is read again whenever
+something else changes it.
+"""
+import copy
+import json
+import os
+import tempfile
+
+class PresetStore:
+    def __init__(self, filename='presets.json', read=True):
+        self.filename = filename
+        self.entries = [] # Every preset in the order it was saved, names can repeat
+        self.index = {} # Name to the position of the newest preset with that name
+        self.stamp = None # When the file was last changed and how big it was, used to notice outside changes
+
+        # Not reading starts the store empty, it still reads the file before every change
+        if read:
+            self.refresh()
+
+    # Reads the file again if something changed it since it was last read, returns whether it did.
+    # A file that isn't a list of presets raises ValueError and leaves the store as it was
+    def refresh(self):
+        stamp = self._stamp()
+        if stamp == self.stamp:
+            return False
+
+        entries = []
+        if stamp is not None:
+            with open(self.filename, 'r') as file:
+                entries = json.load(file)
+
+            if not isinstance(entries, list) or not all(isinstance(entry, dict) and "name" in entry and "config" in entry for entry in entries):
+                raise ValueError(f"{self.filename} isn't a list of presets")
+
+        self.entries = entries
+        self._index()
+        self.stamp = stamp
+        return True
+
+    def names(self):
+        return list(self.index)
+
+    # Gives a copy of the newest preset's config with the name so changing it doesn't change the saved preset,
+    # None if there isn't one
+    def get(self, name):
+        if name not in self.index:
+            return None
+        return copy.deepcopy(self.entries[self.index[name]]["config"])
+
+    # Gives a copy of every preset the same way they are stored in the file
+    def items(self):
+        return copy.deepcopy(self.entries)
+
+    # Adds a preset to the end, a preset with the same name is kept and this one becomes the newest
+    def save(self, name, config):
+        self.refresh()
+
+        self.index[name] = len(self.entries)
+        self.entries.append({"name": name, "config": copy.deepcopy(config)})
+
+        self._write()
+
+    # Removes one preset with the name, the first one with the same config if it's given and the newest if not
+    def delete(self, name, config=None):
+        self.refresh()
+
+        if name not in self.index:
+            return
+
+        position = self.index[name]
+        if config is not None:
+            matches = [i for i, entry in enumerate(self.entries) if entry["name"] == name and entry["config"] == config]
+            if not matches:
+                return
+            position = matches[0]
+
+        del self.entries[position]
+        self._index()
+        self._write()
+
+    def _index(self):
+        self.index = {}
+        for position, entry in enumerate(self.entries):
+            self.index[entry["name"]] = position
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    # Writes every preset to a temporary file then swaps it in for the real one
+    def _write(self):
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        descriptor, temporary = tempfile.mkstemp(prefix=".presets-", suffix=".json", dir=folder)
+
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                json.dump(self.entries, file, indent=4)
+                file.flush()
+                os.fsync(file.fileno())
+            os.chmod(temporary, 0o644) # Temporary files start out only readable by their owner
+            os.replace(temporary, self.filename)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+        self.stamp = self._stamp()
+
+# Finds a preset in the presets file by its name, for tools that need the preset to be there
+def find_preset(name, filename='presets.json'):
+    config = PresetStore(filename).get(name)
+    if config is None:
+        raise ValueError(f"No preset named {name!r} in {filename}")
+
+    return config
@@ -0,0 +1,112 @@
+"""
+Timing for the Andy Warhol Style Image Editor
+
+Turned off unless the AWIM_PROFILE environment variable is set to 1 or the
+editor is started with --profile. While on, every timed stage keeps its recent
+times for percentiles and every call is saved as a Chrome trace event, which
+gets written to awim_trace.json (or AWIM_TRACE / --trace) when the program
+exits. The trace can be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+import atexit
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+class Profiler:
+    def __init__(self, enabled=False, trace_file="awim_trace.json", window=500):
+        self.enabled = enabled
+        self.trace_file = trace_file
+        self.window = window # How many recent times each stage keeps for percentiles
+
+        self.lock = threading.Lock()
+        self.events = [] # Chrome trace events
+        self.times = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self.start = time.perf_counter()
+        self.registered = False
+
+        if enabled:
+            self.enable(trace_file)
+
+    # Turns timing on and writes the trace when the program exits
+    def enable(self, trace_file=None):
+        self.enabled = True
+        if trace_file:
+            self.trace_file = trace_file
+
+        if not self.registered:
+            self.registered = True
+            atexit.register(self.dump)
+
+    # Times the code inside the with block, extra details like bytes can be put in the dict it gives
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield {}
+            return
+
+        details = {}
+        start = time.perf_counter()
+        try:
+            yield details
+        finally:
+            self.add(name, start, time.perf_counter(), details)
+
+    # Records a stage that already happened, start and end come from time.perf_counter
+    def add(self, name, start, end, details=None):
+        if not self.enabled:
+            return
+
+        event = {
+            "name": name,
+            "ph": "X", # A complete event with a start and a duration
+            "ts": (start - self.start) * 1e6, # Microseconds
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": details or {}
+        }
+
+        with self.lock:
+            self.events.append(event)
+            self.times[name].append(end - start)
+
+    # Recent times of a stage in seconds at the given percentiles, None if it hasn't run yet
+    def percentiles(self, name, points=(50, 95, 99)):
+        with self.lock:
+            times = sorted(self.times.get(name, ()))
+
+        if not times:
+            return None
+
+        return {point: times[min(len(times) - 1, int(len(times) * point / 100))] for point in points}
+
+    # One line per stage with how many times it ran and its percentiles in ms
+    def summary(self):
+        lines = []
+        for name in sorted(self.times):
+            values = self.percentiles(name)
+            if values:
+                lines.append(f"{name}: " + " ".join(f"p{point} {seconds * 1000:.1f}ms" for point, seconds in values.items()))
+        return "\n".join(lines)
+
+    # Writes every event to the trace file
+    def dump(self, trace_file=None):
+        trace_file = trace_file or self.trace_file
+
+        with self.lock:
+            events = list(self.events)
+
+        if not events:
+            return
+
+        with open(trace_file, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+# The profiler everything shares
+profiler = Profiler(
+    enabled=os.environ.get("AWIM_PROFILE") == "1",
+    trace_file=os.environ.get("AWIM_TRACE", "awim_trace.json")
+)
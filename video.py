@@ -0,0 +1,222 @@
+"""
+Posterizes video with a saved preset without opening the editor
+
+Reading, posterizing and writing frames each run on their own thread with
+small queues between them. OpenCV and numpy let go of the GIL while they
+work, so the stages really do run at the same time. Cameras can't wait for a
+slow stage, so their oldest waiting frames get dropped instead of falling
+further and further behind. Frames per second and how full each queue is are
+printed once a second.
+
+Examples:
+    python video.py clip.mp4 --preset "Pop Art" --output pop.mp4
+    python video.py 0 --preset "Pop Art" --show
+"""
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+import cv2
+from core import create_lut
+from presets import find_preset
+
+# Codecs that come with OpenCV for each kind of file
+CODECS = {
+    ".mp4": "mp4v",
+    ".avi": "MJPG",
+    ".mkv": "MJPG"
+}
+
+# Counts frames as they go through each stage, every stage can add to it at once
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"read": 0, "posterized": 0, "written": 0, "dropped": 0}
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+# Puts a frame on the next queue, live sources throw away the oldest waiting frame instead of waiting for room
+def put(frames, item, drop, stats, stop):
+    if not drop:
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        return
+
+    while True:
+        try:
+            frames.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                frames.get_nowait()
+                stats.add("dropped")
+            except queue.Empty:
+                pass
+
+# Takes the next frame off a queue, None when the stage before is done or everything is stopping
+def take(frames, stop):
+    while not stop.is_set():
+        try:
+            return frames.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+def read_frames(capture, frames, live, stats, stop):
+    try:
+        while not stop.is_set():
+            ok, frame = capture.read()
+            if not ok:
+                break
+
+            stats.add("read")
+            put(frames, frame, live, stats, stop)
+    finally:
+        put(frames, None, False, stats, stop) # Tells the next stage there are no more frames
+
+def posterize_frames(frames, posterized, breaks, colors, live, stats, stop):
+    # Colors are flipped to bgr so frames are already in the order opencv writes and shows
+    lut = create_lut(breaks, [color[::-1] for color in colors]).reshape(256, 1, 3)
+
+    try:
+        while True:
+            frame = take(frames, stop)
+            if frame is None:
+                break
+
+            # Each frame is only used once, so its own buffer is painted over instead of making a new image.
+            # OpenCV's table lookup needs the gray copied into all three channels but is still about twice as fast
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst=frame)
+            cv2.LUT(frame, lut, dst=frame)
+
+            put(posterized, frame, live, stats, stop)
+            stats.add("posterized")
+    finally:
+        put(posterized, None, False, stats, stop)
+
+# Posterizes every frame of the source, writing them to output and/or showing them as they're made
+def run(source, config, output=None, show=False, live=False, depth=8, codec=None, report=1.0):
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Unable to open video: {source}")
+
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    if not fps or fps != fps or fps <= 0: # Some cameras don't say, nan is the only value not equal to itself
+        fps = 30.0
+
+    frames = queue.Queue(maxsize=depth)
+    posterized = queue.Queue(maxsize=depth)
+    stats = Stats()
+    stop = threading.Event()
+
+    threads = [
+        threading.Thread(target=read_frames, args=(capture, frames, live, stats, stop), daemon=True),
+        threading.Thread(target=posterize_frames, args=(frames, posterized, config["breaks"], config["colors"], live, stats, stop), daemon=True)
+    ]
+    for thread in threads:
+        thread.start()
+
+    writer = None
+    start = last = time.perf_counter()
+    last_written = 0
+
+    # Writing and showing happen here since OpenCV windows only work on the main thread
+    try:
+        while True:
+            frame = take(posterized, stop)
+            if frame is None:
+                break
+
+            if output:
+                if writer is None: # Made from the first frame since cameras don't always report their size
+                    fourcc = codec or CODECS.get(os.path.splitext(output)[1].lower(), "mp4v")
+                    writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*fourcc), fps, (frame.shape[1], frame.shape[0]))
+                    if not writer.isOpened():
+                        raise ValueError(f"Unable to write video: {output}")
+
+                writer.write(frame)
+
+            stats.add("written")
+
+            if show:
+                cv2.imshow("AWIM Video", frame)
+                if cv2.waitKey(1) & 0xFF in (ord("q"), 27): # q or escape stops
+                    break
+
+            now = time.perf_counter()
+            if now - last >= report:
+                counts = stats.snapshot()
+                print(
+                    f"{(counts['written'] - last_written) / (now - last):6.1f} fps | "
+                    f"queues {frames.qsize()}/{depth} {posterized.qsize()}/{depth} | "
+                    f"read {counts['read']} written {counts['written']} dropped {counts['dropped']}",
+                    flush=True
+                )
+                last = now
+                last_written = counts["written"]
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=1)
+
+        capture.release()
+        if writer is not None:
+            writer.release()
+        if show:
+            cv2.destroyAllWindows()
+
+    counts = stats.snapshot()
+    seconds = time.perf_counter() - start
+    print(f"Finished {counts['written']} frames in {seconds:.1f}s, {counts['written'] / max(seconds, 1e-9):.1f} fps, {counts['dropped']} dropped")
+
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a saved preset to a video or a camera.")
+    parser.add_argument("source", help="video file, stream url, or camera number like 0")
+    parser.add_argument("-p", "--preset", required=True, help="name of the preset to apply")
+    parser.add_argument("-o", "--output", help="video file to save to, .mp4 .avi or .mkv")
+    parser.add_argument("--show", action="store_true", help="show the video while it's made, q stops it")
+    parser.add_argument("--live", action="store_true", help="drop frames instead of waiting, on by default for cameras")
+    parser.add_argument("--depth", type=int, default=8, help="frames each queue can hold")
+    parser.add_argument("--codec", help="four letter codec to save with, like mp4v or MJPG")
+    parser.add_argument("--presets", default="presets.json", help="presets file to read the preset from")
+    args = parser.parse_args(argv)
+
+    if not args.output and not args.show:
+        parser.error("give --output, --show, or both")
+
+    try:
+        config = find_preset(args.preset, args.presets)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    # Cameras are given by number
+    source = int(args.source) if args.source.isdigit() else args.source
+    live = args.live or isinstance(source, int)
+
+    try:
+        run(source, config, args.output, args.show, live, max(args.depth, 1), args.codec)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())